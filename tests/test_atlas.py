@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tmxloader.atlas import build_atlas
+from tmxloader.loader import TileMap
+
+MAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.0" orientation="orthogonal" width="2" height="1" tilewidth="16" tileheight="16">
+ <tileset firstgid="17" name="first" tilewidth="32" tileheight="32" tilecount="2">
+  <tile id="0"><image width="32" height="20" source="a.png"/></tile>
+  <tile id="1"><image width="10" height="32" source="b.png"/></tile>
+ </tileset>
+ <tileset firstgid="19" name="second" tilewidth="32" tileheight="32" tilecount="1">
+  <tile id="0"><image width="8" height="8" source="c.png"/></tile>
+ </tileset>
+ <layer name="ground" width="2" height="1">
+  <data encoding="csv">17,19</data>
+ </layer>
+</map>
+"""
+
+
+class BuildAtlasTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.map_source = os.path.join(self.directory, 'map.tmx')
+        with open(self.map_source, 'w') as map_file:
+            map_file.write(MAP)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_packs_only_tiles_of_the_tileset(self):
+        tile_map = TileMap(self.map_source)
+        first, second = tile_map.tilesets
+
+        atlas = build_atlas(first, max_size=(64, 64))
+
+        packed = [tile.gid for page in atlas for tile in page.tiles]
+        self.assertEqual(sorted(packed), [17, 18])
+        self.assertIsNone(tile_map.tiles[19].atlas_page)
+        self.assertIsNone(tile_map.tiles[19].uvs)
+
+    def test_uvs_are_within_the_page(self):
+        for invert_tileset_y in (False, True):
+            tile_map = TileMap(self.map_source, invert_tileset_y=invert_tileset_y)
+            atlas = build_atlas(tile_map.tilesets[0], max_size=(64, 64))
+            for page in atlas:
+                for tile in page.tiles:
+                    x, y = tile.uvs
+                    self.assertTrue(0 <= x and x + tile.width <= page.width)
+                    self.assertTrue(0 <= y and y + tile.height <= page.height)
+
+    def test_layout_is_cached(self):
+        cache_dir = os.path.join(self.directory, 'cache')
+        tile_map = TileMap(self.map_source)
+        atlas = build_atlas(tile_map.tilesets[0], max_size=(64, 64), cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        tile_map = TileMap(self.map_source)
+        cached = build_atlas(tile_map.tilesets[0], max_size=(64, 64), cache_dir=cache_dir)
+        self.assertEqual([page.size for page in cached], [page.size for page in atlas])
+        self.assertEqual([tile.uvs for tile in cached.pages[0].tiles],
+                         [tile.uvs for tile in atlas.pages[0].tiles])
+
+
+if __name__ == '__main__':
+    unittest.main()
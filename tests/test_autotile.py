@@ -0,0 +1,100 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tmxloader import autotile
+from tmxloader.autotile import NeighborMask
+from tmxloader.loader import TileMap
+
+MAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.0" orientation="orthogonal" width="9" height="7" tilewidth="16" tileheight="16">
+ <tileset firstgid="1" name="tiles" tilewidth="16" tileheight="16">
+  <image source="tiles.png" width="64" height="16"/>
+  <wangsets>
+   <wangset name="grass" tile="-1">
+    <wangtile tileid="2" wangid="1,1,1,1,1,1,1,1"/>
+    <wangtile tileid="3" wangid="0,0,1,0,1,0,0,0"/>
+   </wangset>
+  </wangsets>
+ </tileset>
+ <layer name="ground" width="9" height="7">
+  <data encoding="csv">{}</data>
+ </layer>
+</map>
+"""
+
+
+class NeighborMaskTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.map_source = os.path.join(self.directory, 'map.tmx')
+        rng = random.Random(7)
+        gids = [rng.choice((0, 1, 1, 2)) for _ in xrange(9 * 7)]
+        with open(self.map_source, 'w') as map_file:
+            map_file.write(MAP.format(','.join(str(gid) for gid in gids)))
+        self.tile_map = TileMap(self.map_source)
+        self.layer = self.tile_map.layers[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_masks(self, mask):
+        layer = self.layer
+        return [mask.get(x, y) for y in xrange(layer.height) for x in xrange(layer.width)]
+
+    def edit(self):
+        layer = self.layer
+        layer.set_gid(0, 0, 0)
+        layer.fill_rect(3, 2, 3, 2, 1)
+        layer.paste(7, 5, [2, 0, 1, 1], 2)
+        layer.set_gid(8, 3, 1)
+
+    def test_update_dirty_matches_full_recompute(self):
+        for use_numpy in (False, True):
+            if use_numpy and autotile.numpy is None:
+                continue
+            for connectivity in (4, 8):
+                mask = NeighborMask(self.layer, connectivity, gids=[1], use_numpy=use_numpy)
+                self.layer.flush_dirty()
+                self.edit()
+                mask.update_dirty(self.layer.flush_dirty().rects)
+
+                full = NeighborMask(self.layer, connectivity, gids=[1], use_numpy=use_numpy)
+                self.assertEqual(self.get_masks(mask), self.get_masks(full))
+
+    @unittest.skipIf(autotile.numpy is None, 'NumPy is not available')
+    def test_numpy_matches_lists(self):
+        for connectivity in (4, 8):
+            for edge in (False, True):
+                kwargs = dict(connectivity=connectivity, gids=[1, 2], edge=edge)
+                lists = NeighborMask(self.layer, use_numpy=False, **kwargs)
+                arrays = NeighborMask(self.layer, use_numpy=True, **kwargs)
+                self.assertEqual(self.get_masks(arrays), self.get_masks(lists))
+
+                table = self.tileset_table(connectivity)
+                self.assertEqual(arrays.remap(table), lists.remap(table))
+
+    def tileset_table(self, connectivity):
+        return self.tile_map.tilesets[0].get_wang_table(connectivity=connectivity)
+
+    def test_remap_keeps_flags_of_other_cells(self):
+        layer = self.layer
+        # neither of them is a member, so both are left as they are
+        layer.set_gid(8, 0, 0x80000001)
+        layer.set_gid(7, 0, 0x40000001)
+        for use_numpy in (False, True):
+            if use_numpy and autotile.numpy is None:
+                continue
+            gids = layer.wang_remap(self.tile_map.tilesets[0], gids=[2], use_numpy=use_numpy)
+            self.assertEqual(gids[7], 0x40000001)
+            self.assertTrue(all(isinstance(gid, int) for gid in gids))
+            layer.paste(0, 0, gids, layer.width)
+            self.assertTrue(layer.get_cell(8, 0).flags.flipped_horizontally)
+            self.assertTrue(layer.get_cell(7, 0).flags.flipped_vertically)
+            self.assertFalse(layer.get_cell(7, 0).flags.flipped_horizontally)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tmxloader.loader import TileMap
+
+MAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.0" orientation="orthogonal" width="3" height="2" tilewidth="16" tileheight="16">
+ <tileset firstgid="1" name="tiles" tilewidth="16" tileheight="16" margin="1" spacing="2">
+  <image source="tiles.png" width="70" height="40"/>
+ </tileset>
+ <layer name="ground" width="3" height="2">
+  <data encoding="csv">1,0,0,0,0,0</data>
+ </layer>
+</map>
+"""
+
+
+class EditTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.map_source = os.path.join(self.directory, 'map.tmx')
+        with open(self.map_source, 'w') as map_file:
+            map_file.write(MAP)
+        self.loaded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def image_loader(self, tileset=None, image_layer=None):
+        def load(tile=None):
+            self.loaded.append(tile.gid)
+            return object()
+        return load
+
+    def test_edit_loads_only_new_tiles(self):
+        tile_map = TileMap(self.map_source, image_loader=self.image_loader)
+        all_tiles = TileMap(self.map_source, load_unused_tiles=True).tiles
+        layer = tile_map.layers[0]
+        del self.loaded[:]
+
+        layer.set_gid(1, 0, 5)
+        layer.fill_rect(0, 1, 3, 1, 6)
+        layer.set_gid(2, 0, 5)
+
+        self.assertEqual(self.loaded, [5, 6])
+        for gid in (5, 6):
+            self.assertEqual(tile_map.tiles[gid].uvs, all_tiles[gid].uvs)
+            self.assertIsNotNone(tile_map.tiles[gid].image)
+
+    def test_tile_uvs_match_load(self):
+        tile_map = TileMap(self.map_source, load_unused_tiles=True)
+        tileset = tile_map.tilesets[0]
+        self.assertEqual(len(tile_map.tiles), 6)
+        for gid, tile in tile_map.tiles.iteritems():
+            self.assertEqual(tileset.get_tile_uvs(gid), tile.uvs)
+        self.assertIsNone(tileset.get_tile_uvs(7))
+
+
+if __name__ == '__main__':
+    unittest.main()
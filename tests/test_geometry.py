@@ -0,0 +1,103 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tmxloader import geometry
+from tmxloader.geometry import ObjectGeometry
+from tmxloader.loader import TileMap
+
+MAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.0" orientation="orthogonal" width="8" height="8" tilewidth="16" tileheight="16">
+ <objectgroup name="shapes">
+  <object id="1" name="rect" x="20" y="10" width="40" height="10" rotation="90"/>
+  <object id="2" name="ellipse" x="60" y="10" width="40" height="20">
+   <ellipse/>
+  </object>
+  <object id="3" name="corner" x="10" y="70">
+   <polygon points="0,0 40,0 40,10 10,10 10,40 0,40"/>
+  </object>
+  <object id="4" name="rotated_ellipse" x="110" y="60" width="20" height="10" rotation="90">
+   <ellipse/>
+  </object>
+ </objectgroup>
+</map>
+"""
+
+# (point, names of objects containing it) in Tiled's coordinates (y down)
+POINTS = [
+    ((15, 30), ['rect']),
+    ((30, 15), []),
+    ((95, 20), ['ellipse']),
+    ((98, 28), []),
+    ((15, 75), ['corner']),
+    ((15, 100), ['corner']),
+    ((30, 100), []),
+    ((105, 78), ['rotated_ellipse']),
+    ((112, 70), []),
+]
+
+# (start, end, names of crossed objects in order)
+SEGMENTS = [
+    ((0, 35), (128, 35), ['rect']),
+    ((0, 75), (128, 75), ['corner', 'rotated_ellipse']),
+    ((128, 75), (0, 75), ['rotated_ellipse', 'corner']),
+    ((15, 100), (15, 0), ['corner', 'rect']),
+    ((30, 100), (45, 85), []),
+]
+
+
+class ObjectGeometryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.map_source = os.path.join(self.directory, 'map.tmx')
+        with open(self.map_source, 'w') as map_file:
+            map_file.write(MAP)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_geometries(self, invert_y):
+        # elements only keep weak references to the map
+        self.tile_map = TileMap(self.map_source, invert_y=invert_y)
+        objects = self.tile_map.objects.list()
+        geometries = [ObjectGeometry(objects, use_numpy=False), ObjectGeometry(objects, cell_size=7, use_numpy=False)]
+        if geometry.numpy is not None:
+            geometries.append(ObjectGeometry(objects, use_numpy=True))
+        return geometries
+
+    @staticmethod
+    def convert(point, invert_y):
+        x, y = point
+        return (x, 128 - y) if invert_y else (x, y)
+
+    def test_contains_points(self):
+        for invert_y in (False, True):
+            points = [self.convert(point, invert_y) for point, _ in POINTS]
+            for shapes in self.get_geometries(invert_y):
+                results = shapes.contains_points(points)
+                self.assertEqual([[obj.name for obj in hits] for hits in results],
+                                 [names for _, names in POINTS])
+
+    def test_intersects_segment(self):
+        for invert_y in (False, True):
+            for shapes in self.get_geometries(invert_y):
+                for start, end, names in SEGMENTS:
+                    hits = shapes.intersects_segment(self.convert(start, invert_y), self.convert(end, invert_y))
+                    self.assertEqual([obj.name for obj in hits], names)
+
+    @unittest.skipIf(geometry.numpy is None, 'NumPy is not available')
+    def test_numpy_matches_python(self):
+        tile_map = TileMap(self.map_source)
+        objects = tile_map.objects.list()
+        rng = random.Random(3)
+        points = [(rng.uniform(-10, 140), rng.uniform(-10, 140)) for _ in xrange(2000)]
+        expected = ObjectGeometry(objects, use_numpy=False).contains_points(points)
+        for cell_size in (None, 5, 1000):
+            shapes = ObjectGeometry(objects, cell_size=cell_size, use_numpy=True)
+            self.assertEqual(shapes.contains_points(points), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
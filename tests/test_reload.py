@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tmxloader.loader import TileMap
+from tmxloader.utils import InvalidLayerData
+from tmxloader.watcher import MapWatcher
+
+MAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.0" orientation="orthogonal" width="2" height="2" tilewidth="16" tileheight="16">
+ <tileset firstgid="1" name="tiles" tilewidth="16" tileheight="16">
+  <image source="tiles.png" width="32" height="16"/>
+ </tileset>
+ <layer name="ground" width="2" height="2">
+  <data encoding="csv">1,1,1,1</data>
+ </layer>
+ <layer name="top" width="2" height="2">
+  <data encoding="csv">0,2,0,0</data>
+ </layer>
+</map>
+"""
+
+
+class ReloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.map_source = os.path.join(self.directory, 'map.tmx')
+        self.write_map(MAP)
+        self.loaded = []
+        self.tile_map = TileMap(self.map_source, image_loader=self.image_loader)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def image_loader(self, tileset=None, image_layer=None):
+        def load(tile=None):
+            self.loaded.append(tile)
+            return object()
+        return load
+
+    def write_map(self, content):
+        with open(self.map_source, 'w') as map_file:
+            map_file.write(content)
+
+    def test_keeps_unchanged_layers_and_images(self):
+        tile_map = self.tile_map
+        ground, top = tile_map.layers
+        tiles = dict(tile_map.tiles)
+        del self.loaded[:]
+
+        self.write_map(MAP.replace('0,2,0,0', '2,2,0,0'))
+        diff = tile_map.reload()
+
+        self.assertFalse(diff.full)
+        self.assertEqual(diff.layers.unchanged, (ground, ))
+        self.assertEqual(diff.layers.changed, ((top, tile_map.layers[1]), ))
+        self.assertIs(tile_map.layers[0], ground)
+        self.assertEqual(diff.tilesets.unchanged, tuple(tile_map.tilesets))
+        for gid, tile in tiles.iteritems():
+            self.assertIs(tile_map.tiles[gid], tile)
+        self.assertEqual(self.loaded, [])
+        self.assertEqual([cell.gid for cell in tile_map.layers[1]], [2, 2])
+
+    def test_failed_reload_leaves_map_intact(self):
+        tile_map = self.tile_map
+        tilesets, layers = list(tile_map.tilesets), list(tile_map.layers)
+        tiles = dict(tile_map.tiles)
+        signatures = dict(tile_map.file_signatures)
+
+        # changed tileset and truncated layer data in the same save
+        broken = MAP.replace('name="tiles"', 'name="renamed"').replace('0,2,0,0', '0,2')
+        self.write_map(broken)
+        self.assertRaises(InvalidLayerData, tile_map.reload)
+
+        self.assertEqual(tile_map.tilesets, tilesets)
+        self.assertEqual(tile_map.layers, layers)
+        self.assertEqual(tile_map.tiles, tiles)
+        self.assertEqual(tile_map.file_signatures, signatures)
+        self.assertEqual([cell.tile.image for cell in layers[1]], [tiles[2].image])
+
+    def test_failed_full_rebuild_leaves_map_intact(self):
+        tile_map = self.tile_map
+        layers, tiles = list(tile_map.layers), dict(tile_map.tiles)
+
+        self.write_map(MAP.replace('width="2" height="2" tilewidth', 'width="2" height="2" nextobjectid="5" tilewidth')
+                          .replace('0,2,0,0', '0,2'))
+        self.assertRaises(InvalidLayerData, tile_map.reload)
+
+        self.assertIsNone(tile_map.nextobjectid)
+        self.assertEqual(tile_map.layers, layers)
+        self.assertEqual(tile_map.tiles, tiles)
+
+    def test_watcher_retries_after_failed_reload(self):
+        tile_map = self.tile_map
+        top = tile_map.layers[1]
+        watcher = MapWatcher(tile_map, interval=0)
+
+        self.write_map(MAP.replace('name="tiles"', 'name="renamed"').replace('0,2,0,0', '0,2'))
+        self.assertIsNone(watcher.poll())
+        self.assertIs(tile_map.layers[1], top)
+        self.assertEqual([cell.gid for cell in top], [2])
+
+        self.write_map(MAP.replace('name="tiles"', 'name="renamed"').replace('0,2,0,0', '0,2,0,2'))
+        diff = watcher.poll()
+        self.assertIsNotNone(diff)
+        self.assertEqual(tile_map.tilesets[0].name, 'renamed')
+        self.assertEqual([cell.gid for cell in tile_map.layers[1]], [2, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
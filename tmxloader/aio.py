@@ -0,0 +1,86 @@
+"""
+Loading maps without blocking the event loop.
+Requires trollius (asyncio for python 2).
+
+Files are read and images are loaded in the loop's executor, so image loader
+has to be safe to call from other threads. Raw layer data is decoded there as well,
+only cells are built in the loop itself, rows_per_step rows at once.
+"""
+from functools import partial
+from xml.etree import ElementTree
+
+import trollius as asyncio
+from trollius import From, Return
+
+from loader import TileMap
+from utils import get_file_signature
+
+
+def parse_xml(source):
+    return ElementTree.parse(source).getroot()
+
+
+def get_external_tilesets(tile_map, node):
+    paths = set()
+    for tileset_node in node.findall('tileset'):
+        source = tileset_node.get('source')
+        if source and source.endswith('.tsx'):
+            paths.add(tile_map.get_absolute_path(source))
+    return list(paths)
+
+
+@asyncio.coroutine
+def load_map(map_source, map_cls=TileMap, loop=None, executor=None, rows_per_step=32, **kwargs):
+    loop = loop or asyncio.get_event_loop()
+    run = partial(loop.run_in_executor, executor)
+    tile_map = map_cls(map_source, defer_load=True, **kwargs)
+
+    tile_map.file_signatures[map_source] = yield From(run(get_file_signature, map_source))
+    node = yield From(run(parse_xml, map_source))
+
+    paths = get_external_tilesets(tile_map, node)
+    tileset_nodes = yield From(asyncio.gather(*[run(parse_xml, path) for path in paths], loop=loop))
+    tile_map.preparsed_sources.update(zip(paths, tileset_nodes))
+
+    # hashing, reading and raw decoding run in the executor, only building cells runs in the loop
+    steps = tile_map.iter_build(node, rows_per_step)
+    result = None
+    while True:
+        try:
+            request = steps.send(result)
+        except StopIteration:
+            break
+        if request is None:
+            result = None
+            yield From(asyncio.sleep(0, loop=loop))
+        else:
+            result = yield From(run(request))
+
+    requests = list(tile_map.iter_image_requests())
+    images = yield From(asyncio.gather(
+        *[run(partial(loader, **loader_kwargs)) for _, loader, loader_kwargs in requests], loop=loop
+    ))
+    for (element, _, _), image in zip(requests, images):
+        element.image = image
+
+    tile_map.preparsed_sources.clear()
+    raise Return(tile_map)
+
+
+@asyncio.coroutine
+def load_maps(map_sources, limit=4, loop=None, **kwargs):
+    """
+    Load several maps at once, at most `limit` of them at the same time.
+    Maps are returned in the order of map_sources.
+    """
+    loop = loop or asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(limit, loop=loop)
+
+    @asyncio.coroutine
+    def load_with_limit(map_source):
+        with (yield From(semaphore)):
+            tile_map = yield From(load_map(map_source, loop=loop, **kwargs))
+        raise Return(tile_map)
+
+    tile_maps = yield From(asyncio.gather(*[load_with_limit(s) for s in map_sources], loop=loop))
+    raise Return(tile_maps)
@@ -0,0 +1,206 @@
+"""
+Packing images of an image collection tileset into atlas pages.
+
+Layout is computed from the tile sizes alone, composing the page images
+is left to the renderer, e.g.:
+
+    atlas = build_atlas(tileset, cache_dir='.atlas')
+    for page in atlas.pages:
+        texture = create_texture(page.size)
+        for tile in page.tiles:
+            texture.blit(tile.image, tile.rect)
+"""
+import os
+import json
+import hashlib
+
+from utils import get_file_signature
+
+
+class SkylinePacker(object):
+    """
+    Bottom-left skyline packer, skyline is a list of [x, y, width] segments
+    describing the top edge of the already placed rectangles.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]
+
+    def find_position(self, width, height):
+        best = None
+        skyline = self.skyline
+        for index, (x, _, _) in enumerate(skyline):
+            if x + width > self.width:
+                break
+            # rect has to rest on the highest segment it spans
+            y, right, end = 0, x + width, index
+            while skyline[end][0] < right:
+                y = max(y, skyline[end][1])
+                end += 1
+                if end == len(skyline):
+                    break
+            if y + height > self.height:
+                continue
+            if best is None or y < best[1]:
+                best = (index, y)
+        return best
+
+    def insert(self, width, height):
+        position = self.find_position(width, height)
+        if position is None:
+            return
+
+        index, y = position
+        skyline = self.skyline
+        x = skyline[index][0]
+        right = x + width
+        skyline.insert(index, [x, y + height, width])
+
+        # cut off the segments hidden under the new one
+        i = index + 1
+        while i < len(skyline) and skyline[i][0] < right:
+            segment = skyline[i]
+            segment_right = segment[0] + segment[2]
+            if segment_right <= right:
+                del skyline[i]
+                continue
+            segment[2] = segment_right - right
+            segment[0] = right
+            break
+
+        # merge neighbours of the same height
+        i = 0
+        while i < len(skyline) - 1:
+            if skyline[i][1] == skyline[i + 1][1]:
+                skyline[i][2] += skyline[i + 1][2]
+                del skyline[i + 1]
+            else:
+                i += 1
+        return x, y
+
+
+def pack(sizes, max_width, max_height, padding=0):
+    """
+    Place rectangles of the given (width, height) sizes on as few pages as possible.
+    Returns a list of (page, x, y) in the order of sizes and a list of (width, height)
+    of the pages, trimmed to the area actually used.
+    """
+    order = sorted(xrange(len(sizes)), key=lambda i: (sizes[i][1], sizes[i][0]), reverse=True)
+    placements = [None] * len(sizes)
+    packers = []
+    page_sizes = []
+
+    for i in order:
+        width, height = sizes[i]
+        if width > max_width or height > max_height:
+            raise Exception('Image of size {}x{} does not fit into {}x{} atlas page.'.format(
+                width, height, max_width, max_height))
+
+        for page, packer in enumerate(packers):
+            position = packer.insert(width + padding, height + padding)
+            if position is not None:
+                break
+        else:
+            page = len(packers)
+            # padding is only needed between the images, not after the last one
+            packer = SkylinePacker(max_width + padding, max_height + padding)
+            packers.append(packer)
+            page_sizes.append((0, 0))
+            position = packer.insert(width + padding, height + padding)
+
+        x, y = position
+        page_width, page_height = page_sizes[page]
+        page_sizes[page] = max(page_width, x + width), max(page_height, y + height)
+        placements[i] = (page, x, y)
+
+    return placements, page_sizes
+
+
+class AtlasPage(object):
+    def __init__(self, index, width, height):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.tiles = []
+
+    def __unicode__(self):
+        return u'{}@{}'.format(self.__class__.__name__, self.index)
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+class Atlas(object):
+    def __init__(self, tileset, pages):
+        self.tileset = tileset
+        self.pages = pages
+
+    def __iter__(self):
+        return iter(self.pages)
+
+
+def get_layout_key(tiles, max_size, padding):
+    sources = [(tile.gid, tile.source, get_file_signature(tile.source), tile.size) for tile in tiles]
+    return hashlib.sha1(repr((max_size, padding, sources))).hexdigest()
+
+
+def load_layout(path):
+    with open(path) as layout_file:
+        layout = json.load(layout_file)
+    placements = dict((int(gid), tuple(placement)) for gid, placement in layout['tiles'].iteritems())
+    return placements, [tuple(size) for size in layout['pages']]
+
+
+def save_layout(path, placements, page_sizes):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as layout_file:
+        json.dump({'tiles': placements, 'pages': page_sizes}, layout_file)
+
+
+def build_atlas(tileset, max_size=(2048, 2048), padding=1, cache_dir=None):
+    """
+    Pack tiles of the image collection tileset into atlas pages and point every tile
+    to its place on the page (TileElement.atlas_page and uvs).
+    With cache_dir the layout is stored on disk and reused as long as
+    the tiles' image files don't change.
+    """
+    if not tileset.is_images_collection:
+        raise Exception('{} is not an image collection tileset.'.format(tileset))
+
+    tiles = [tile for tile in tileset if tile.source]
+    for tile in tiles:
+        if not tile.width or not tile.height:
+            raise Exception('Size of {} image is unknown.'.format(tile))
+
+    layout_path = None
+    if cache_dir is not None:
+        layout_key = get_layout_key(tiles, max_size, padding)
+        layout_path = os.path.join(cache_dir, 'atlas-{}.json'.format(layout_key))
+
+    if layout_path is not None and os.path.exists(layout_path):
+        placements, page_sizes = load_layout(layout_path)
+    else:
+        max_width, max_height = max_size
+        placements, page_sizes = pack([tile.size for tile in tiles], max_width, max_height, padding)
+        placements = dict((tile.gid, placement) for tile, placement in zip(tiles, placements))
+        if layout_path is not None:
+            save_layout(layout_path, placements, page_sizes)
+
+    invert_y = tileset.root.invert_tileset_y
+    pages = [AtlasPage(index, width, height) for index, (width, height) in enumerate(page_sizes)]
+    for tile in tiles:
+        page, x, y = placements[tile.gid]
+        page = pages[page]
+        # TileElement.set_uvs flips against the tile's height, atlas places have to use page's height
+        tile.uvs = (x, page.height - y - tile.height) if invert_y else (x, y)
+        tile.atlas_page = page.index
+        page.tiles.append(tile)
+    return Atlas(tileset, pages)
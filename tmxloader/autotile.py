@@ -0,0 +1,218 @@
+"""
+Whole-layer neighbourhood bitmasks and Wang (terrain) based tile selection.
+
+Bit i of a mask is set when the i-th neighbour is a member, neighbours are
+ordered clockwise starting from the top, as positions of Tiled's wang ids:
+  connectivity 4: top, right, bottom, left
+  connectivity 8: top, top-right, right, bottom-right, bottom, bottom-left, left, top-left
+Masks are flat sequences indexed with y * width + x, like TileLayer.data.
+NumPy is used when it's available.
+"""
+from utils import BOOLEAN_VALUES, encode_gid
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NEIGHBOURS = {
+    4: ((0, -1), (1, 0), (0, 1), (-1, 0)),
+    8: ((0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)),
+}
+
+
+def get_neighbours(connectivity):
+    try:
+        return NEIGHBOURS[connectivity]
+    except KeyError:
+        raise Exception('Unsupported connectivity: {}.'.format(connectivity))
+
+
+def build_wang_table(wang_tiles, color=1, connectivity=8):
+    """
+    Map every possible mask to the gid of the best matching wang tile (or None).
+    wang_tiles is a sequence of (gid, wangid) pairs, wangid positions set to 0 aren't checked.
+    A corner counts as the given color when both of its edges and (with connectivity 8)
+    the diagonal neighbour are members.
+    """
+    step = 8 // len(get_neighbours(connectivity))
+    table = []
+    for mask in xrange(1 << (8 // step)):
+        edges = [bool(mask & (1 << (position // step))) if position % step == 0 else None
+                 for position in xrange(8)]
+        wangid = []
+        for position in xrange(8):
+            if position % 2 == 0:
+                wangid.append(edges[position])
+                continue
+            filled = edges[position - 1] and edges[(position + 1) % 8]
+            if step == 1:
+                filled = filled and edges[position]
+            wangid.append(filled)
+
+        best, best_score = None, -1
+        for gid, tile_wangid in wang_tiles:
+            score = 0
+            for expected, actual in zip(tile_wangid, wangid):
+                if not expected:
+                    continue
+                if (expected == color) != actual:
+                    break
+                score += 1
+            else:
+                if score > best_score:
+                    best, best_score = gid, score
+        table.append(best)
+    return table
+
+
+class NeighborMask(object):
+    """
+    Membership of every cell of the layer and neighbourhood masks computed from it.
+    Membership is decided by gids, tile_property (present and not false) and predicate
+    (called with the tile), all of the given ones have to pass.
+    With edge=True cells outside of the layer count as members.
+    """
+
+    def __init__(self, layer, connectivity=8, gids=None, tile_property=None, predicate=None,
+                 edge=False, use_numpy=None):
+        self.layer = layer
+        self.connectivity = connectivity
+        self.neighbours = get_neighbours(connectivity)
+        self.gids = frozenset(gids) if gids is not None else None
+        self.tile_property = tile_property
+        self.predicate = predicate
+        self.edge = edge
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        self.membership_cache = {}
+
+        size = layer.width * layer.height
+        if self.use_numpy:
+            self.members = numpy.zeros(size, dtype=numpy.bool_)
+            self.masks = numpy.zeros(size, dtype=numpy.uint8)
+        else:
+            self.members = [False] * size
+            self.masks = [0] * size
+        self.update(0, 0, layer.width, layer.height)
+
+    def is_member(self, gid):
+        cache = self.membership_cache
+        member = cache.get(gid)
+        if member is None:
+            member = cache[gid] = self.check_membership(gid)
+        return member
+
+    def check_membership(self, gid):
+        if self.gids is not None and gid not in self.gids:
+            return False
+        tile = self.layer.root.tiles[gid]
+        if self.tile_property is not None:
+            value = tile.properties.get(self.tile_property)
+            if value is None or value in BOOLEAN_VALUES[False]:
+                return False
+        return self.predicate is None or bool(self.predicate(tile))
+
+    def get(self, x, y):
+        return int(self.masks[self.layer.cell_index(x, y)])
+
+    def update_dirty(self, rects):
+        for rect in rects:
+            self.update(*rect)
+
+    def update(self, x, y, width, height):
+        """
+        Recompute membership of the given area and masks of the area grown by one cell.
+        """
+        rect = self.layer.clip_rect(x, y, width, height)
+        if rect is None:
+            return
+        x, y, width, height = rect
+        if self.use_numpy:
+            self.update_members_numpy(x, y, width, height)
+        else:
+            self.update_members(x, y, width, height)
+
+        rect = self.layer.clip_rect(x - 1, y - 1, width + 2, height + 2)
+        if self.use_numpy:
+            self.update_masks_numpy(*rect)
+        else:
+            self.update_masks(*rect)
+
+    def update_members(self, x, y, width, height):
+        data = self.layer.data
+        members = self.members
+        is_member = self.is_member
+        layer_width = self.layer.width
+        for cy in xrange(y, y + height):
+            for index in xrange(cy * layer_width + x, cy * layer_width + x + width):
+                cell = data[index]
+                members[index] = cell is not None and is_member(cell.gid)
+
+    def update_masks(self, x, y, width, height):
+        members = self.members
+        masks = self.masks
+        edge = self.edge
+        layer_width, layer_height = self.layer.width, self.layer.height
+        neighbours = [(dx, dy, 1 << bit) for bit, (dx, dy) in enumerate(self.neighbours)]
+        for cy in xrange(y, y + height):
+            for cx in xrange(x, x + width):
+                mask = 0
+                for dx, dy, bit in neighbours:
+                    nx, ny = cx + dx, cy + dy
+                    if 0 <= nx < layer_width and 0 <= ny < layer_height:
+                        if members[ny * layer_width + nx]:
+                            mask |= bit
+                    elif edge:
+                        mask |= bit
+                masks[cy * layer_width + cx] = mask
+
+    def update_members_numpy(self, x, y, width, height):
+        layer = self.layer
+        data = layer.data
+        layer_width = layer.width
+        gids = numpy.zeros((height, width), dtype=numpy.uint32)
+        for row, cy in enumerate(xrange(y, y + height)):
+            start = cy * layer_width + x
+            gids[row] = [cell.gid if cell is not None else 0 for cell in data[start:start + width]]
+
+        member_gids = [gid for gid in numpy.unique(gids) if gid and self.is_member(int(gid))]
+        members = self.members.reshape(layer.height, layer_width)
+        members[y:y + height, x:x + width] = numpy.isin(gids, member_gids)
+
+    def update_masks_numpy(self, x, y, width, height):
+        layer = self.layer
+        members = self.members.reshape(layer.height, layer.width)
+
+        # members around the area, cells outside of the layer are filled with the edge value
+        window = numpy.empty((height + 2, width + 2), dtype=numpy.bool_)
+        window.fill(self.edge)
+        top, left = max(y - 1, 0), max(x - 1, 0)
+        bottom, right = min(y + height + 1, layer.height), min(x + width + 1, layer.width)
+        window[top - y + 1:bottom - y + 1, left - x + 1:right - x + 1] = members[top:bottom, left:right]
+
+        result = numpy.zeros((height, width), dtype=numpy.uint8)
+        for bit, (dx, dy) in enumerate(self.neighbours):
+            neighbour = window[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+            result |= neighbour.astype(numpy.uint8) << bit
+        self.masks.reshape(layer.height, layer.width)[y:y + height, x:x + width] = result
+
+    def remap(self, table):
+        """
+        Gids of the layer with member cells replaced according to the mask -> gid table,
+        cells without a match in the table keep their gid and flip flags, empty cells are 0.
+        Always a flat list (also with NumPy), ready to be passed to TileLayer.paste.
+        """
+        gids = [encode_gid(cell.gid, cell.flags) if cell is not None else 0 for cell in self.layer.data]
+        if self.use_numpy:
+            gids = numpy.array(gids, dtype=numpy.int64)
+            lookup = numpy.array([0 if gid is None else gid for gid in table], dtype=numpy.int64)
+            remapped = lookup[self.masks]
+            replace = self.members & (remapped != 0)
+            gids[replace] = remapped[replace]
+            return gids.tolist()
+
+        members = self.members
+        for index, mask in enumerate(self.masks):
+            if members[index] and table[mask] is not None:
+                gids[index] = table[mask]
+        return gids
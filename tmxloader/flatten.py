@@ -0,0 +1,125 @@
+"""
+Precomputed draw lists of stacked tile layers with the covered cells left out.
+
+A cell is dropped when an opaque cell is drawn over it in a higher layer.
+Cell is opaque when its layer is fully opaque and not offset, its tile has
+the map's tile size, isn't animated and passes the is_opaque predicate
+(by default the tile has to have `opaque` property set to true).
+Tiles bigger than a map cell and cells of offset layers can't be proven
+to be covered, so they are always kept.
+"""
+from itertools import chain
+
+from loader import TileLayer
+from utils import convert_to_bool
+
+
+def is_tile_opaque(tile):
+    value = tile.properties.get('opaque')
+    if value is None:
+        return False
+    try:
+        return convert_to_bool(value)
+    except Exception:
+        return False
+
+
+class FlattenedLayers(object):
+    def __init__(self, tile_map, layers=None, is_opaque=is_tile_opaque):
+        if layers is None:
+            layers = [l for l in tile_map.visible_layers if isinstance(l, TileLayer)]
+        self.tile_map = tile_map
+        self.layers = tuple(layers)
+        self.is_opaque = is_opaque
+        self.width = tile_map.width
+        self.height = tile_map.height
+
+        for layer in self.layers:
+            if (layer.width, layer.height) != (self.width, self.height):
+                raise Exception('Size of {} differs from the map size.'.format(layer))
+
+        self.draw_lists = [()] * (self.width * self.height)
+        self._layer_cells = None
+        self.refresh(0, 0, self.width, self.height)
+
+    def __iter__(self):
+        return self.iter_cells()
+
+    @property
+    def cell_count(self):
+        return sum(len(draw_list) for draw_list in self.draw_lists)
+
+    @property
+    def layer_cells(self):
+        if self._layer_cells is None:
+            layer_cells = dict((layer, []) for layer in self.layers)
+            for draw_list in self.draw_lists:
+                for cell in draw_list:
+                    layer_cells[cell.parent].append(cell)
+            self._layer_cells = layer_cells
+        return self._layer_cells
+
+    def iter_cells(self, layer=None):
+        """
+        Cells that have to be drawn, layer by layer (or of a single layer),
+        so layers can still be interleaved with objects and images.
+        """
+        layer_cells = self.layer_cells
+        if layer is not None:
+            return iter(layer_cells[layer])
+        return chain.from_iterable(layer_cells[l] for l in self.layers)
+
+    def get_draw_list(self, x, y):
+        return self.draw_lists[y * self.width + x]
+
+    def refresh_dirty(self, rects):
+        for rect in rects:
+            self.refresh(*rect)
+
+    def refresh(self, x, y, width, height):
+        """
+        Recompute draw lists of the given area, e.g. after some of the layers were edited.
+        """
+        tile_map = self.tile_map
+        tiles = tile_map.tiles
+        tile_size = (tile_map.tilewidth, tile_map.tileheight)
+        is_opaque = self.is_opaque
+        map_width = self.width
+
+        # top-most layers first
+        layers = [l for l in reversed(self.layers) if l.visible]
+        layers_data = [l.data for l in layers]
+        aligned_layers = [not l.offsetx and not l.offsety for l in layers]
+        opaque_layers = [aligned and l.opacity >= 1 for l, aligned in zip(layers, aligned_layers)]
+        opaque_tiles = {}
+
+        draw_lists = self.draw_lists
+        for cy in xrange(max(y, 0), min(y + height, self.height)):
+            for cx in xrange(max(x, 0), min(x + width, map_width)):
+                index = cy * map_width + cx
+                draw_list = []
+                covered = False
+                for data, aligned_layer, opaque_layer in zip(layers_data, aligned_layers, opaque_layers):
+                    cell = data[index]
+                    if cell is None:
+                        continue
+
+                    tile = tiles[cell.gid]
+                    aligned = aligned_layer and tile.size == tile_size
+                    if covered and aligned:
+                        continue
+                    draw_list.append(cell)
+
+                    if covered or not aligned or not opaque_layer:
+                        continue
+                    gid = cell.gid
+                    opaque = opaque_tiles.get(gid)
+                    if opaque is None:
+                        animated = 'animation_frames' in tile.properties
+                        opaque = opaque_tiles[gid] = not animated and is_opaque(tile)
+                    covered = opaque
+
+                draw_list.reverse()
+                draw_lists[index] = tuple(draw_list)
+
+        self._layer_cells = None
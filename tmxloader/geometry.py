@@ -0,0 +1,394 @@
+"""
+Precomputed geometry of objects for batched hit testing.
+
+Shapes are expressed in the same coordinates as object positions
+(with y axis inverted when the map inverts it) and take rotation into account.
+"""
+import math
+from array import array
+from collections import defaultdict
+
+from utils import ObjectType
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+POLYGON = 0
+POLYLINE = 1
+ELLIPSE = 2
+
+
+def get_local_outline(obj):
+    """
+    Vertices of the object relative to its position, in Tiled's (y down) space.
+    """
+    if obj.points:
+        # points are stored as the object's position moved by their local offsets
+        outline = [(px - obj.x, py - obj.y) for px, py in obj.points]
+    elif obj.type == ObjectType.Tile:
+        # tile objects are aligned to their bottom-left corner
+        outline = [(0, -obj.height), (obj.width, -obj.height), (obj.width, 0), (0, 0)]
+    else:
+        outline = [(0, 0), (obj.width, 0), (obj.width, obj.height), (0, obj.height)]
+    return rotate(outline, obj.rotation)
+
+
+def rotate(points, degrees):
+    if not degrees:
+        return list(points)
+    # Tiled rotates clockwise around the object's position
+    angle = math.radians(degrees)
+    cos, sin = math.cos(angle), math.sin(angle)
+    return [(x * cos - y * sin, x * sin + y * cos) for x, y in points]
+
+
+def signed_area(points):
+    area = 0.0
+    for i, (x0, y0) in enumerate(points):
+        x1, y1 = points[i - 1]
+        area += x1 * y0 - x0 * y1
+    return area / 2.0
+
+
+def cross(ox, oy, ax, ay, bx, by):
+    return (ax - ox) * (by - oy) - (ay - oy) * (bx - ox)
+
+
+def triangulate(points):
+    """
+    Ear clipping triangulation of a simple (possibly concave) polygon.
+    Returns triangles as tuples of indices into points.
+    """
+    indices = range(len(points))
+    if len(indices) < 3:
+        return []
+    if signed_area(points) < 0:
+        indices.reverse()
+
+    triangles = []
+    while len(indices) > 3:
+        count = len(indices)
+        for k in xrange(count):
+            a, b, c = indices[k - 1], indices[k], indices[(k + 1) % count]
+            (ax, ay), (bx, by), (cx, cy) = points[a], points[b], points[c]
+            if cross(ax, ay, bx, by, cx, cy) <= 0:
+                continue
+            for i in indices:
+                if i in (a, b, c) or points[i] in (points[a], points[b], points[c]):
+                    continue
+                px, py = points[i]
+                if (cross(ax, ay, bx, by, px, py) >= 0 and cross(bx, by, cx, cy, px, py) >= 0 and
+                        cross(cx, cy, ax, ay, px, py) >= 0):
+                    break
+            else:
+                triangles.append((a, b, c))
+                del indices[k]
+                break
+        else:
+            # self-intersecting or degenerate polygon, there are no more ears to clip
+            break
+
+    triangles.extend((indices[0], indices[i], indices[i + 1]) for i in xrange(1, len(indices) - 1))
+    return triangles
+
+
+class ObjectGeometry(object):
+    """
+    Packed geometry of a collection of objects:
+     - aabbs: min_x, min_y, max_x, max_y per object
+     - vertices: x, y of polygons and polylines (rotated corners for rectangles and tiles)
+     - edges: x0, y0, x1, y1 per edge
+     - triangles: vertex indices, three per triangle
+    Per object ranges are given by the *_offsets arrays, so data of the object i
+    lays between offsets[i] and offsets[i + 1]. Ellipses are kept as their center
+    and the two (scaled) axes.
+    Point tests are vectorized when NumPy is available.
+    """
+
+    def __init__(self, objects, cell_size=None, use_numpy=None):
+        self.objects = list(objects)
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        self.kinds = array('b')
+        self.aabbs = array('d')
+        self.vertices = array('d')
+        self.vertex_offsets = array('l', [0])
+        self.edges = array('d')
+        self.edge_offsets = array('l', [0])
+        self.triangles = array('l')
+        self.triangle_offsets = array('l', [0])
+        self.ellipses = {}
+
+        for obj in self.objects:
+            self.add(obj)
+        self.cell_size = float(cell_size or self.get_default_cell_size())
+        self.grid = self.build_grid()
+
+    def __len__(self):
+        return len(self.objects)
+
+    def add(self, obj):
+        index = len(self.kinds)
+        sign = -1 if obj.root.invert_y else 1
+
+        if obj.type == ObjectType.Ellipse:
+            rx, ry = obj.width / 2.0, obj.height / 2.0
+            (cx, cy), (ux, uy), (vx, vy) = rotate([(rx, ry), (rx, 0), (0, ry)], obj.rotation)
+            cx, cy, uy, vy = obj.x + cx, obj.y + sign * cy, sign * uy, sign * vy
+            self.ellipses[index] = (cx, cy, ux, uy, vx, vy)
+            half_width, half_height = math.hypot(ux, vx), math.hypot(uy, vy)
+            self.kinds.append(ELLIPSE)
+            self.aabbs.extend((cx - half_width, cy - half_height, cx + half_width, cy + half_height))
+            points = []
+        else:
+            points = [(obj.x + x, obj.y + sign * y) for x, y in get_local_outline(obj)]
+            kind = POLYLINE if obj.type == ObjectType.Polyline else POLYGON
+            self.kinds.append(kind)
+            xs, ys = [x for x, _ in points], [y for _, y in points]
+            self.aabbs.extend((min(xs), min(ys), max(xs), max(ys)))
+
+            first_vertex = len(self.vertices) // 2
+            for x, y in points:
+                self.vertices.extend((x, y))
+            pairs = zip(points, points[1:])
+            if kind == POLYGON:
+                pairs.append((points[-1], points[0]))
+                for triangle in triangulate(points):
+                    self.triangles.extend(first_vertex + i for i in triangle)
+            for (x0, y0), (x1, y1) in pairs:
+                self.edges.extend((x0, y0, x1, y1))
+
+        self.vertex_offsets.append(len(self.vertices) // 2)
+        self.edge_offsets.append(len(self.edges) // 4)
+        self.triangle_offsets.append(len(self.triangles) // 3)
+
+    def get_aabb(self, index):
+        return tuple(self.aabbs[index * 4:index * 4 + 4])
+
+    def get_vertices(self, index):
+        vertices = self.vertices
+        return [(vertices[2 * i], vertices[2 * i + 1])
+                for i in xrange(self.vertex_offsets[index], self.vertex_offsets[index + 1])]
+
+    def get_triangles(self, index):
+        vertices = self.vertices
+        triangles = self.triangles
+        result = []
+        for t in xrange(self.triangle_offsets[index], self.triangle_offsets[index + 1]):
+            result.append(tuple((vertices[2 * v], vertices[2 * v + 1]) for v in triangles[3 * t:3 * t + 3]))
+        return result
+
+    def get_default_cell_size(self):
+        aabbs = self.aabbs
+        sizes = [max(aabbs[i + 2] - aabbs[i], aabbs[i + 3] - aabbs[i + 1]) for i in xrange(0, len(aabbs), 4)]
+        if not sizes:
+            return 1.0
+        return max(sum(sizes) / len(sizes), 1.0)
+
+    def get_cells(self, min_x, min_y, max_x, max_y):
+        size = self.cell_size
+        for gx in xrange(int(math.floor(min_x / size)), int(math.floor(max_x / size)) + 1):
+            for gy in xrange(int(math.floor(min_y / size)), int(math.floor(max_y / size)) + 1):
+                yield gx, gy
+
+    def iter_segment_cells(self, x0, y0, x1, y1):
+        """
+        Grid cells crossed by the segment, in order (Amanatides-Woo traversal).
+        """
+        size = self.cell_size
+        gx, gy = int(math.floor(x0 / size)), int(math.floor(y0 / size))
+        end_x, end_y = int(math.floor(x1 / size)), int(math.floor(y1 / size))
+        dx, dy = x1 - x0, y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # distance (as the fraction of the segment) to the next vertical and horizontal cell border
+        infinity = float('inf')
+        delta_x = size / abs(dx) if dx else infinity
+        delta_y = size / abs(dy) if dy else infinity
+        next_x = ((gx + (dx > 0)) * size - x0) / dx if dx else infinity
+        next_y = ((gy + (dy > 0)) * size - y0) / dy if dy else infinity
+
+        yield gx, gy
+        # the number of steps is known up front, so rounding errors can't make us miss the end
+        for _ in xrange(abs(end_x - gx) + abs(end_y - gy)):
+            if gy == end_y or (gx != end_x and next_x < next_y):
+                gx += step_x
+                next_x += delta_x
+            else:
+                gy += step_y
+                next_y += delta_y
+            yield gx, gy
+
+    def build_grid(self):
+        grid = defaultdict(list)
+        for index in xrange(len(self.kinds)):
+            for cell in self.get_cells(*self.get_aabb(index)):
+                grid[cell].append(index)
+        return grid
+
+    def contains_points(self, points):
+        """
+        For every (x, y) point return the list of objects containing it.
+        """
+        if self.use_numpy:
+            return self.contains_points_numpy(points)
+
+        size = self.cell_size
+        grid = self.grid
+        aabbs = self.aabbs
+        kinds = self.kinds
+        objects = self.objects
+        results = []
+        for x, y in points:
+            hits = []
+            for index in grid.get((int(math.floor(x / size)), int(math.floor(y / size))), ()):
+                k = index * 4
+                if not (aabbs[k] <= x <= aabbs[k + 2] and aabbs[k + 1] <= y <= aabbs[k + 3]):
+                    continue
+                kind = kinds[index]
+                if kind == POLYGON and self.polygon_contains(index, x, y):
+                    hits.append(objects[index])
+                elif kind == ELLIPSE and self.ellipse_contains(index, x, y):
+                    hits.append(objects[index])
+            results.append(hits)
+        return results
+
+    def contains_points_numpy(self, points):
+        coordinates = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        xs, ys = coordinates[:, 0], coordinates[:, 1]
+        aabbs = self.aabbs
+        objects = self.objects
+        results = [[] for _ in xrange(len(coordinates))]
+
+        for index, kind in enumerate(self.kinds):
+            if kind == POLYLINE:
+                continue
+            k = index * 4
+            candidates = numpy.nonzero(
+                (xs >= aabbs[k]) & (xs <= aabbs[k + 2]) & (ys >= aabbs[k + 1]) & (ys <= aabbs[k + 3])
+            )[0]
+            if not len(candidates):
+                continue
+            if kind == POLYGON:
+                inside = self.polygon_contains_numpy(index, xs[candidates], ys[candidates])
+            else:
+                inside = self.ellipse_contains_numpy(index, xs[candidates], ys[candidates])
+            for point in candidates[inside]:
+                results[point].append(objects[index])
+        return results
+
+    def polygon_contains_numpy(self, index, xs, ys):
+        edges = self.edges
+        inside = numpy.zeros(len(xs), dtype=numpy.bool_)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for e in xrange(self.edge_offsets[index] * 4, self.edge_offsets[index + 1] * 4, 4):
+                x0, y0, x1, y1 = edges[e], edges[e + 1], edges[e + 2], edges[e + 3]
+                crossing = ((y0 > ys) != (y1 > ys)) & (xs < (x1 - x0) * (ys - y0) / (y1 - y0) + x0)
+                inside ^= crossing
+        return inside
+
+    def ellipse_contains_numpy(self, index, xs, ys):
+        cx, cy, ux, uy, vx, vy = self.ellipses[index]
+        det = ux * vy - uy * vx
+        if not det:
+            return numpy.zeros(len(xs), dtype=numpy.bool_)
+        dx, dy = xs - cx, ys - cy
+        s, t = (dx * vy - dy * vx) / det, (ux * dy - uy * dx) / det
+        return s * s + t * t <= 1
+
+    def polygon_contains(self, index, x, y):
+        edges = self.edges
+        inside = False
+        for e in xrange(self.edge_offsets[index] * 4, self.edge_offsets[index + 1] * 4, 4):
+            x0, y0, x1, y1 = edges[e], edges[e + 1], edges[e + 2], edges[e + 3]
+            if (y0 > y) != (y1 > y) and x < (x1 - x0) * (y - y0) / (y1 - y0) + x0:
+                inside = not inside
+        return inside
+
+    def to_ellipse_space(self, index, x, y):
+        # coordinates in which the ellipse is the unit circle
+        cx, cy, ux, uy, vx, vy = self.ellipses[index]
+        det = ux * vy - uy * vx
+        if not det:
+            return
+        dx, dy = x - cx, y - cy
+        return (dx * vy - dy * vx) / det, (ux * dy - uy * dx) / det
+
+    def ellipse_contains(self, index, x, y):
+        point = self.to_ellipse_space(index, x, y)
+        return point is not None and point[0] ** 2 + point[1] ** 2 <= 1
+
+    def intersects_segment(self, start, end):
+        """
+        Objects crossed by the segment, ordered by distance from its start.
+        Closed shapes containing the start point are reported first.
+        """
+        (x0, y0), (x1, y1) = start, end
+        min_x, max_x = min(x0, x1), max(x0, x1)
+        min_y, max_y = min(y0, y1), max(y0, y1)
+        aabbs = self.aabbs
+        kinds = self.kinds
+
+        tested = set()
+        hits = []
+        for cell in self.iter_segment_cells(x0, y0, x1, y1):
+            for index in self.grid.get(cell, ()):
+                if index in tested:
+                    continue
+                tested.add(index)
+                k = index * 4
+                if aabbs[k] > max_x or aabbs[k + 2] < min_x or aabbs[k + 1] > max_y or aabbs[k + 3] < min_y:
+                    continue
+                if kinds[index] == ELLIPSE:
+                    t = self.ellipse_entry(index, x0, y0, x1, y1)
+                else:
+                    t = self.edges_entry(index, x0, y0, x1, y1)
+                if t is not None:
+                    hits.append((t, index))
+
+        hits.sort()
+        return [self.objects[index] for _, index in hits]
+
+    def intersects_segments(self, segments):
+        return [self.intersects_segment(start, end) for start, end in segments]
+
+    def edges_entry(self, index, x0, y0, x1, y1):
+        if self.kinds[index] == POLYGON and self.polygon_contains(index, x0, y0):
+            return 0.0
+
+        edges = self.edges
+        dx, dy = x1 - x0, y1 - y0
+        entry = None
+        for e in xrange(self.edge_offsets[index] * 4, self.edge_offsets[index + 1] * 4, 4):
+            ex, ey = edges[e], edges[e + 1]
+            sx, sy = edges[e + 2] - ex, edges[e + 3] - ey
+            denominator = dx * sy - dy * sx
+            if not denominator:
+                continue
+            qx, qy = ex - x0, ey - y0
+            t = (qx * sy - qy * sx) / denominator
+            u = (qx * dy - qy * dx) / denominator
+            if 0 <= t <= 1 and 0 <= u <= 1 and (entry is None or t < entry):
+                entry = t
+        return entry
+
+    def ellipse_entry(self, index, x0, y0, x1, y1):
+        start = self.to_ellipse_space(index, x0, y0)
+        if start is None:
+            return
+        end = self.to_ellipse_space(index, x1, y1)
+        (sx, sy), (ex, ey) = start, end
+        dx, dy = ex - sx, ey - sy
+
+        c = sx * sx + sy * sy - 1
+        if c <= 0:
+            return 0.0
+        a = dx * dx + dy * dy
+        b = 2 * (sx * dx + sy * dy)
+        discriminant = b * b - 4 * a * c
+        if not a or discriminant < 0:
+            return
+        t = (-b - math.sqrt(discriminant)) / (2 * a)
+        if 0 <= t <= 1:
+            return t
@@ -1,12 +1,18 @@
 import os
 import zlib
+import hashlib
 import weakref
 from base64 import b64decode
+from functools import partial
 from xml.etree import ElementTree
-from itertools import islice, product, ifilter, imap, chain
+from itertools import islice, product, ifilter, chain
+from collections import defaultdict, OrderedDict
 
-from utils import to_python, unpack_struct, decode_gid,\
-    AnimationFrame, ObjectType, LayerType, FilterIterator
+from autotile import NeighborMask, build_wang_table
+from geometry import ObjectGeometry
+from utils import to_python, unpack_struct, decode_gid, parse_wangid,\
+    AnimationFrame, ObjectType, LayerType, FilterIterator, DirtyRegions,\
+    ElementsDiff, MapDiff, InvalidLayerData, get_file_signature, run_steps
 
 
 class Element(object):
@@ -14,6 +20,8 @@ class Element(object):
 
     def __init__(self):
         self.properties = {}
+        # digest of the source nodes (and files) this element was built from, see TileMap.reload
+        self.content_hash = None
 
     def __unicode__(self):
         return u'<{}@{}>'.format(
@@ -89,8 +97,7 @@ class ChildMixin(object):
 
 class AbsoluteSourceMixin(object):
     def prepare_attr_source(self, value):
-        base_dir = os.path.dirname(self.root.source)
-        return os.path.abspath(os.path.join(base_dir, value))
+        return self.root.get_absolute_path(value)
 
 
 class ObjectElement(ChildMixin, Element):
@@ -197,6 +204,7 @@ class ObjectGroup(ChildMixin, Element):
         self.visible = True
         # Enum?
         self.draworder = 'topdown'
+        self._geometry = None
 
         self.init_from_node(node)
 
@@ -209,8 +217,22 @@ class ObjectGroup(ChildMixin, Element):
         for object_node in node.findall('object'):
             self.add_object(object_node)
 
+    @property
+    def geometry(self):
+        # built on first use, objects added afterwards invalidate it
+        if self._geometry is None:
+            self._geometry = ObjectGeometry(self.objects)
+        return self._geometry
+
+    def contains_points(self, points):
+        return self.geometry.contains_points(points)
+
+    def intersects_segment(self, start, end):
+        return self.geometry.intersects_segment(start, end)
+
     def add_object(self, object_node):
         self.objects.append(self.parent.objectelement_cls(node=object_node, parent=self))
+        self._geometry = None
 
 
 class ImageLayer(ChildMixin, AbsoluteSourceMixin, Element):
@@ -253,6 +275,8 @@ class TileElement(ChildMixin, AbsoluteSourceMixin, Element):
         super(TileElement, self).__init__(parent)
         self.uvs = None
         self.image = None
+        # index of the page for tiles packed into an atlas (see tmxloader.atlas)
+        self.atlas_page = None
 
         self.width = 0
         self.height = 0
@@ -260,6 +284,7 @@ class TileElement(ChildMixin, AbsoluteSourceMixin, Element):
 
         self.id = None
         self.gid = None
+        self.terrain = None
 
         if node is not None:
             self.init_from_node(node)
@@ -297,6 +322,11 @@ class TileElement(ChildMixin, AbsoluteSourceMixin, Element):
         self.gid = self.parent.firstgid + local_id
         return local_id
 
+    @staticmethod
+    def prepare_attr_terrain(terrain):
+        # terrain indexes of top-left, top-right, bottom-left and bottom-right corners
+        return tuple(int(t) if t else None for t in terrain.split(','))
+
     def handle_animation(self, node):
         frames = []
         map_obj = self.root
@@ -362,10 +392,16 @@ class Cell(ChildMixin):
 
 class TileLayer(ChildMixin, Element):
     description_attribute = 'name'
+    # size (in cells) of the square chunks reported by flush_dirty
+    chunk_size = 16
 
-    def __init__(self, node, parent):
+    def __init__(self, node, parent, decode=True):
         super(TileLayer, self).__init__(parent)
         self.data = None
+        self.dirty_rects = []
+        self.dirty_chunks = set()
+        # tiles registered on the fly since the last load_new_tiles
+        self.new_tiles = []
 
         self.name = None
         self.width = 0
@@ -375,15 +411,26 @@ class TileLayer(ChildMixin, Element):
         self.offsety = 0
         self.visible = True
 
-        self.init_from_node(node)
+        self.init_from_node(node, decode=decode)
 
     def __iter__(self):
         return ifilter(None, self.data)
 
-    def init_from_node(self, node):
+    def init_from_node(self, node, decode=True):
         super(TileLayer, self).init_from_node(node)
+        if decode:
+            self.decode_data(node.find('data'))
 
-        data_node = node.find('data')
+    def decode_data(self, data_node):
+        for _ in self.iter_build_cells(self.decode_gids(data_node)):
+            pass
+
+    @staticmethod
+    def decode_gids(data_node):
+        """
+        Raw gids stored in the <data> node, doesn't touch the layer so it can run in any thread.
+        """
+        # TODO: handle scenario when gids are stored in <tile>s, rather than <data> tag
         encoding = data_node.get('encoding')
         data = data_node.text.strip()
         if encoding == 'base64':
@@ -395,34 +442,162 @@ class TileLayer(ChildMixin, Element):
                 raise NotImplementedError
             elif compression is not None:
                 raise Exception('Unsupported data compression: {}.'.format(compression))
-            data = iter(unpack_struct(data))
+            return unpack_struct(data)
 
         elif encoding == 'csv':
-            ichain = chain.from_iterable
-            data = ichain(imap(int, ifilter(None, line.split(','))) for line in data.splitlines())
-        else:
-            raise Exception('Unsupported data encoding: {}.'.format(encoding))
+            return [int(value) for line in data.splitlines() for value in line.split(',') if value]
 
-        # TODO: handle scenario when gids are stored in <tile>s, rather than <data> tag
+        raise Exception('Unsupported data encoding: {}.'.format(encoding))
 
+    def iter_build_cells(self, gids, rows_per_step=None):
+        """
+        Create cells from the decoded gids, yielding the number of rows built so far
+        after every rows_per_step rows, so the work can be interleaved with other tasks.
+        """
         width = self.width
         height = self.height
-        add_cell = self.add_cell
-        self.data = tuple(add_cell(next(data), x, y) for y in xrange(height) for x in xrange(width))
+        if len(gids) < width * height:
+            raise InvalidLayerData('Layer data is shorter than {}x{} cells in {}.'.format(width, height, self))
 
-    def add_cell(self, gid, x, y):
+        add_cell = self.add_cell
+        cells = []
+        for y in xrange(height):
+            row = y * width
+            cells.extend([add_cell(gids[row + x], x, y) for x in xrange(width)])
+            if rows_per_step and (y + 1) % rows_per_step == 0 and y + 1 < height:
+                yield y + 1
+        self.data = cells
+        # images of the tiles found at load time are loaded along with all the others
+        self.new_tiles = []
+        yield height
+
+    def add_cell(self, gid, x, y, flags=None):
         if not gid:
             return
 
-        gid, flags = decode_gid(gid)
+        if flags is None:
+            gid, flags = decode_gid(gid)
         # add tiles that haven't been listed in tileset
         if gid not in self.parent.tiles:
             self.add_tile(gid)
         return Cell(self, gid, x, y, flags)
 
+    def cell_index(self, x, y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError('Cell ({}, {}) is out of {} bounds.'.format(x, y, self))
+        return y * self.width + x
+
+    def get_cell(self, x, y):
+        return self.data[self.cell_index(x, y)]
+
+    def set_gid(self, x, y, gid, flags=None):
+        """
+        Replace a single cell. gid may carry the flip bits (as stored in .tmx data)
+        unless flags are given explicitly, gid 0 clears the cell.
+        """
+        self.data[self.cell_index(x, y)] = self.add_cell(gid, x, y, flags)
+        self.load_new_tiles()
+        self.mark_dirty(x, y, 1, 1)
+
+    def fill_rect(self, x, y, width, height, gid, flags=None):
+        rect = self.clip_rect(x, y, width, height)
+        if rect is None:
+            return
+        x, y, width, height = rect
+
+        data = self.data
+        add_cell = self.add_cell
+        for cy in xrange(y, y + height):
+            start = cy * self.width + x
+            data[start:start + width] = [add_cell(gid, cx, cy, flags) for cx in xrange(x, x + width)]
+        self.load_new_tiles()
+        self.mark_dirty(x, y, width, height)
+
+    def paste(self, x, y, gids, width):
+        """
+        Copy a block of raw gids (row by row, `width` gids per row) with its top-left corner at x, y.
+        Parts of the block that fall outside of the layer are dropped.
+        """
+        height = len(gids) // width
+        rect = self.clip_rect(x, y, width, height)
+        if rect is None:
+            return
+        left, top, clipped_width, clipped_height = rect
+
+        data = self.data
+        add_cell = self.add_cell
+        for cy in xrange(top, top + clipped_height):
+            row = (cy - y) * width - x
+            start = cy * self.width + left
+            data[start:start + clipped_width] = [
+                add_cell(gids[row + cx], cx, cy) for cx in xrange(left, left + clipped_width)
+            ]
+        self.load_new_tiles()
+        self.mark_dirty(left, top, clipped_width, clipped_height)
+
+    def load_new_tiles(self):
+        # tiles first used by an edit need uvs and images, just like the ones used at load time
+        if self.new_tiles:
+            self.parent.load_tile_images(self.new_tiles)
+            self.new_tiles = []
+
+    def clip_rect(self, x, y, width, height):
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + width, self.width), min(y + height, self.height)
+        if left >= right or top >= bottom:
+            return
+        return left, top, right - left, bottom - top
+
+    @property
+    def is_dirty(self):
+        return bool(self.dirty_rects)
+
+    def mark_dirty(self, x, y, width, height):
+        rects = self.dirty_rects
+        if rects:
+            # consecutive edits of the same area (e.g. painting with a brush) are reported once
+            last_x, last_y, last_width, last_height = rects[-1]
+            if (last_x <= x and last_y <= y and x + width <= last_x + last_width and
+                    y + height <= last_y + last_height):
+                return
+        rects.append((x, y, width, height))
+
+        size = self.chunk_size
+        self.dirty_chunks.update(product(
+                xrange(x // size, (x + width - 1) // size + 1),
+                xrange(y // size, (y + height - 1) // size + 1)
+        ))
+
+    def flush_dirty(self):
+        """
+        Return regions changed since the previous flush as rects (x, y, width, height)
+        and (column, row) chunks of chunk_size cells, then forget about them.
+        """
+        dirty = DirtyRegions(tuple(self.dirty_rects), frozenset(self.dirty_chunks))
+        self.dirty_rects = []
+        self.dirty_chunks = set()
+        return dirty
+
     def add_tile(self, gid):
         tileset = self.parent.get_tileset_by_gid(gid)
-        tileset.add_tile(None, gid=gid, width=tileset.tilewidth, height=tileset.tileheight)
+        tile = tileset.add_tile(None, gid=gid, width=tileset.tilewidth, height=tileset.tileheight)
+        self.new_tiles.append(tile)
+        return tile
+
+    def get_neighbor_mask(self, connectivity=8, **kwargs):
+        """
+        NeighborMask of the layer, keep it and call its update_dirty with the rects
+        returned by flush_dirty to refresh it after edits.
+        """
+        return NeighborMask(self, connectivity, **kwargs)
+
+    def wang_remap(self, tileset, wangset=None, color=1, connectivity=8, **kwargs):
+        """
+        Flat list of gids (y * width + x) with member cells replaced by the matching wang tiles,
+        see NeighborMask.remap.
+        """
+        mask = self.get_neighbor_mask(connectivity, **kwargs)
+        return mask.remap(tileset.get_wang_table(wangset, color, connectivity))
 
 
 class TileSet(ChildMixin, AbsoluteSourceMixin, Element):
@@ -443,13 +618,17 @@ class TileSet(ChildMixin, AbsoluteSourceMixin, Element):
         self.tilewidth = 0
         self.tileheight = 0
         self.firstgid = None
+        self.external_source = None
+        # name -> ((gid, wangid), ...)
+        self.wangsets = OrderedDict()
 
         self.init_from_node(node)
         # TODO: handle <tileoffset> tag
 
     def __iter__(self):
         tiles = self.parent.tiles
-        for gid in xrange(self.firstgid, self.firstgid + self.maxgid):
+        # maxgid is the highest gid registered in this tileset, not a count
+        for gid in xrange(self.firstgid, self.maxgid + 1):
             try:
                 yield tiles[gid]
             except KeyError:
@@ -466,7 +645,8 @@ class TileSet(ChildMixin, AbsoluteSourceMixin, Element):
         source = self.source
         if source and os.path.splitext(source)[1] == '.tsx':
             self.source = None
-            external_tileset_node = ElementTree.parse(source).getroot()
+            self.external_source = source
+            external_tileset_node = self.root.parse_source(source)
             self.init_from_node(external_tileset_node)
 
         image_node = node.find('image')
@@ -476,6 +656,56 @@ class TileSet(ChildMixin, AbsoluteSourceMixin, Element):
         for tile_node in node.iter('tile'):
             self.add_tile(tile_node)
 
+        for wangset_node in node.iter('wangset'):
+            self.add_wangset(wangset_node)
+
+    def add_wangset(self, node):
+        wang_tiles = []
+        for wangtile_node in node.findall('wangtile'):
+            gid = self.firstgid + to_python('tileid', wangtile_node.get('tileid'))
+            wang_tiles.append((gid, parse_wangid(wangtile_node.get('wangid'))))
+        self.wangsets[node.get('name')] = tuple(wang_tiles)
+
+    @property
+    def terrain_wang_tiles(self):
+        # terrain corners expressed as wang ids, terrain index 0 becomes color 1
+        wang_tiles = []
+        for tile in self:
+            if tile.terrain is None:
+                continue
+            top_left, top_right, bottom_left, bottom_right = tile.terrain
+            corners = {1: top_right, 3: bottom_right, 5: bottom_left, 7: top_left}
+            wangid = tuple(0 if corners.get(i) is None else corners[i] + 1 for i in xrange(8))
+            wang_tiles.append((tile.gid, wangid))
+        return tuple(wang_tiles)
+
+    def get_wang_table(self, wangset=None, color=1, connectivity=8):
+        """
+        Mask -> gid table (see tmxloader.autotile) built from the given wangset,
+        the first one when not given, or from tiles' terrains when there are no wangsets.
+        """
+        if wangset is not None:
+            wang_tiles = self.wangsets[wangset]
+        elif self.wangsets:
+            wang_tiles = self.wangsets.values()[0]
+        else:
+            wang_tiles = self.terrain_wang_tiles
+        return build_wang_table(wang_tiles, color, connectivity)
+
+    def get_tile_uvs(self, gid):
+        """
+        Position of the tile in tileset's image, None when it's outside of the image.
+        """
+        step_x, step_y = self.tilewidth + self.spacing, self.tileheight + self.spacing
+        columns = len(xrange(self.margin, self.width + 1 - self.tilewidth, step_x))
+        rows = len(xrange(self.margin, self.height + 1 - self.tileheight, step_y))
+        if not columns:
+            return
+        row, column = divmod(gid - self.firstgid, columns)
+        if row >= rows:
+            return
+        return self.margin + column * step_x, self.margin + row * step_y
+
     def add_tile(self, node, **kwargs):
         tile = TileElement(node, self, **kwargs)
         self.parent.tiles[tile.gid] = tile
@@ -509,7 +739,7 @@ class TileMap(Element):
     objectelement_cls = ObjectElement
 
     def __init__(self, map_source, image_loader=None, load_unused_tiles=False,
-                 invert_y=True, invert_tileset_y=False):
+                 invert_y=True, invert_tileset_y=False, defer_load=False):
         super(TileMap, self).__init__()
         self.root = self
         self.parent = None
@@ -531,8 +761,14 @@ class TileMap(Element):
         self.tiles = {}
         self.layers = []
         self.tilesets = []
+        # (mtime, size) of every file the map was built from, keyed by absolute path
+        self.file_signatures = {}
+        # nodes already parsed by the loader itself, consumed by parse_source
+        self.preparsed_sources = {}
 
-        self.load_map_data(map_source)
+        # with defer_load map data is expected to be loaded later on (see tmxloader.aio)
+        if not defer_load:
+            self.load_map_data(map_source)
 
     @property
     def size(self):
@@ -566,38 +802,320 @@ class TileMap(Element):
     def get_tile(self, gid):
         return self.tiles[gid]
 
-    def load_map_data(self, map_source):
-        root_node = ElementTree.parse(map_source).getroot()
-        return self.init_from_node(root_node)
+    def get_absolute_path(self, path):
+        base_dir = os.path.dirname(self.source)
+        return os.path.abspath(os.path.join(base_dir, path))
 
-    def init_from_node(self, node):
-        super(TileMap, self).init_from_node(node)
+    def parse_source(self, source):
+        node = self.preparsed_sources.pop(source, None)
+        if node is None:
+            node = ElementTree.parse(source).getroot()
+        return node
 
-        for child in node.findall('tileset'):
-            self.add_tileset(child)
+    def load_map_data(self, map_source):
+        self.file_signatures[map_source] = get_file_signature(map_source)
+        root_node = self.parse_source(map_source)
+        return self.init_from_node(root_node)
 
-        for child in node.getchildren():
-            tag = child.tag
-            if tag in LayerType:
-                self.add_layer(child)
+    def init_from_node(self, node, hashes=None):
+        run_steps(self.iter_build(node, hashes=hashes))
 
         self.load_images()
+        self.preparsed_sources.clear()
+
+    def iter_build(self, node, rows_per_step=None, hashes=None):
+        """
+        Create tilesets and layers one by one, yielding None after each of them.
+        Blocking work (hashing, reading files, raw layer decoding) is yielded as a callable,
+        whose result has to be sent back, see utils.run_steps.
+        With rows_per_step tile layers are built in steps of that many rows,
+        otherwise they are decoded by their constructors.
+        Images aren't loaded here.
+        """
+        super(TileMap, self).init_from_node(node)
+        if hashes is None:
+            hashes = yield partial(self.hash_map, node)
+        self.content_hash, tileset_hashes, layer_hashes = hashes
+
+        for child, content_hash in zip(node.findall('tileset'), tileset_hashes):
+            self.add_tileset(child, content_hash)
+            yield
+
+        for child, content_hash in zip(self.get_layer_nodes(node), layer_hashes):
+            if child.tag != LayerType.TileLayer or rows_per_step is None:
+                self.add_layer(child, content_hash)
+                yield
+                continue
 
-    def add_tileset(self, node):
-        self.tilesets.append(self.tileset_cls(node=node, parent=self))
+            layer = self.add_layer(child, content_hash, decode=False)
+            gids = yield partial(layer.decode_gids, child.find('data'))
+            for _ in layer.iter_build_cells(gids, rows_per_step):
+                yield
 
-    def add_layer(self, node):
+    @staticmethod
+    def get_layer_nodes(node):
+        return [child for child in node.getchildren() if child.tag in LayerType]
+
+    def add_tileset(self, node, content_hash=None):
+        tileset = self.create_tileset(node, content_hash)
+        self.tilesets.append(tileset)
+        return tileset
+
+    def create_tileset(self, node, content_hash=None):
+        if content_hash is None:
+            content_hash = self.hash_tileset_node(node)
+        tileset = self.tileset_cls(node=node, parent=self)
+        tileset.content_hash = content_hash
+        return tileset
+
+    def add_layer(self, node, content_hash=None, decode=True):
+        layer = self.create_layer(node, content_hash, decode)
+        self.layers.append(layer)
+        return layer
+
+    def create_layer(self, node, content_hash=None, decode=True):
+        if content_hash is None:
+            content_hash = self.hash_nodes(node)
         tag = node.tag
         if tag == LayerType.TileLayer:
-            self.layers.append(self.tilelayer_cls(node=node, parent=self))
+            # subclasses with the plain (node, parent) constructor keep working
+            kwargs = {} if decode else {'decode': False}
+            layer = self.tilelayer_cls(node=node, parent=self, **kwargs)
         elif tag == LayerType.ImageLayer:
-            self.layers.append(self.imagelayer_cls(node=node, parent=self))
+            layer = self.imagelayer_cls(node=node, parent=self)
         elif tag == LayerType.ObjectGroup:
-            self.layers.append(self.objectgroup_cls(node=node, parent=self))
+            layer = self.objectgroup_cls(node=node, parent=self)
         else:
             raise Exception('Unknown layer type: "{}".'.format(tag))
+        layer.content_hash = content_hash
+        return layer
+
+    def hash_nodes(self, *nodes):
+        """
+        Digest of the given nodes and of the images they refer to,
+        so the result changes when any of those files is modified.
+        """
+        digest = hashlib.md5()
+        for node in nodes:
+            digest.update(ElementTree.tostring(node))
+            for image_node in node.iter('image'):
+                source = image_node.get('source')
+                if not source:
+                    continue
+                path = self.get_absolute_path(source)
+                signature = self.file_signatures[path] = get_file_signature(path)
+                digest.update(repr((path, signature)))
+        return digest.hexdigest()
+
+    def hash_map(self, node):
+        """
+        Content hashes of the map itself, its tilesets and its layers.
+        Doesn't modify the map's elements, so it can run in any thread.
+        """
+        return (
+            self.hash_map_node(node),
+            [self.hash_tileset_node(n) for n in node.findall('tileset')],
+            [self.hash_nodes(n) for n in self.get_layer_nodes(node)]
+        )
 
-    def load_images(self):
+    def hash_map_node(self, node):
+        # only the map's own attributes and properties, children are hashed separately
+        header = ElementTree.Element(node.tag, node.attrib)
+        properties_node = node.find('properties')
+        if properties_node is not None:
+            header.append(properties_node)
+        return self.hash_nodes(header)
+
+    def hash_tileset_node(self, node):
+        source = node.get('source')
+        if not source or os.path.splitext(source)[1] != '.tsx':
+            return self.hash_nodes(node)
+
+        path = self.get_absolute_path(source)
+        self.file_signatures[path] = get_file_signature(path)
+        # keep the parsed file around, so the tileset doesn't have to read it again
+        external_tileset_node = self.preparsed_sources[path] = self.parse_source(path)
+        return self.hash_nodes(node, external_tileset_node)
+
+    def reload(self, map_source=None):
+        """
+        Read the map file again and rebuild only the tilesets and layers whose content
+        (including external tilesets and images) has changed since they were loaded.
+        Unchanged elements, their tiles and images are kept as they are.
+        Changes to the map's own attributes (size, orientation...) require full rebuild.
+        When the reload fails the map is left as it was before.
+        Returns MapDiff describing what was replaced.
+        """
+        state = self.get_state()
+        if map_source is not None:
+            self.source = map_source
+
+        old_signatures = self.file_signatures
+        self.file_signatures = {self.source: get_file_signature(self.source)}
+        try:
+            node = self.parse_source(self.source)
+            hashes = self.hash_map(node)
+            if hashes[0] != self.content_hash:
+                return self.rebuild(node, hashes)
+            return self.update_from_node(node, hashes, old_signatures)
+        except Exception:
+            # old signatures come back too, so a watcher tries again once the files change
+            self.restore_state(state)
+            raise
+        finally:
+            self.preparsed_sources.clear()
+
+    def get_state(self):
+        """
+        Shallow copy of the map's attributes (tilesets, layers, properties...) for restore_state.
+        Tiles are copied as well, since their dict is modified in place.
+        """
+        state = dict(self.__dict__)
+        state['tiles'] = dict(self.tiles)
+        return state
+
+    def restore_state(self, state):
+        self.__dict__.clear()
+        self.__dict__.update(state)
+
+    def update_from_node(self, node, hashes, old_signatures):
+        _, tileset_hashes, layer_hashes = hashes
+        tileset_nodes = zip(tileset_hashes, node.findall('tileset'))
+        layer_nodes = zip(layer_hashes, self.get_layer_nodes(node))
+
+        changed_files = set(
+            path for path, signature in old_signatures.iteritems()
+            if self.file_signatures.get(path, signature) != signature
+        )
+        reusable_images = {}
+
+        matched_tilesets, stale_tilesets = self.match_elements(self.tilesets, tileset_nodes)
+        for tileset in stale_tilesets:
+            for gid, tile in self.tiles.items():
+                if tile.parent is tileset:
+                    self.collect_reusable_image(tile, reusable_images, changed_files)
+                    del self.tiles[gid]
+        self.tilesets = [
+            item if item_hash is None else self.create_tileset(item, item_hash)
+            for item_hash, item in matched_tilesets
+        ]
+        tilesets_diff = self.diff_elements(matched_tilesets, self.tilesets, stale_tilesets)
+
+        matched_layers, stale_layers = self.match_elements(self.layers, layer_nodes)
+        for layer in stale_layers:
+            if isinstance(layer, ImageLayer):
+                self.collect_reusable_image(layer, reusable_images, changed_files)
+        self.layers = [
+            item if item_hash is None else self.create_layer(item, item_hash)
+            for item_hash, item in matched_layers
+        ]
+        layers_diff = self.diff_elements(matched_layers, self.layers, stale_layers)
+
+        # tiles that were registered on the fly by the kept layers could be gone with their tileset
+        for layer in layers_diff.unchanged:
+            if isinstance(layer, ImageLayer):
+                continue
+            for element in layer:
+                gid = element.gid
+                if gid is not None and gid not in self.tiles:
+                    tileset = self.get_tileset_by_gid(gid)
+                    tileset.add_tile(None, gid=gid, width=tileset.tilewidth, height=tileset.tileheight)
+
+        self.load_images(only_missing=True, reusable_images=reusable_images)
+        return MapDiff(False, tilesets_diff, layers_diff)
+
+    def rebuild(self, node, hashes=None):
+        old_tilesets, old_layers = tuple(self.tilesets), tuple(self.layers)
+        self.properties = {}
+        self.tiles = {}
+        self.layers = []
+        self.tilesets = []
+        self.init_from_node(node, hashes)
+        return MapDiff(
+            True,
+            ElementsDiff(tuple(self.tilesets), old_tilesets, (), ()),
+            ElementsDiff(tuple(self.layers), old_layers, (), ())
+        )
+
+    @staticmethod
+    def match_elements(elements, hashed_nodes):
+        """
+        Pair nodes with the loaded elements built from identical content.
+        Returns list of (None, element) for matched and (content_hash, node) for
+        unmatched nodes, along with the elements that weren't matched.
+        """
+        by_hash = defaultdict(list)
+        for element in elements:
+            by_hash[element.content_hash].append(element)
+
+        matched = []
+        for content_hash, node in hashed_nodes:
+            candidates = by_hash.get(content_hash)
+            if candidates:
+                matched.append((None, candidates.pop(0)))
+            else:
+                matched.append((content_hash, node))
+
+        matched_ids = set(id(element) for content_hash, element in matched if content_hash is None)
+        stale = [element for element in elements if id(element) not in matched_ids]
+        return matched, stale
+
+    @staticmethod
+    def diff_elements(matched, elements, stale):
+        unchanged, created = [], []
+        for (content_hash, _), element in zip(matched, elements):
+            (unchanged if content_hash is None else created).append(element)
+
+        # element replaced by a one with the same type and name counts as changed
+        stale_by_key = defaultdict(list)
+        for element in stale:
+            stale_by_key[(type(element), element.name)].append(element)
+        added, changed = [], []
+        for element in created:
+            candidates = stale_by_key.get((type(element), element.name))
+            if candidates:
+                changed.append((candidates.pop(0), element))
+            else:
+                added.append(element)
+        replaced_ids = set(id(old) for old, _ in changed)
+        removed = [element for element in stale if id(element) not in replaced_ids]
+        return ElementsDiff(tuple(added), tuple(removed), tuple(changed), tuple(unchanged))
+
+    def collect_reusable_image(self, element, reusable_images, changed_files):
+        key = self.get_image_key(element)
+        if element.image is not None and key[0] not in changed_files:
+            reusable_images[key] = element.image
+
+    @staticmethod
+    def get_image_key(element):
+        if isinstance(element, ImageLayer):
+            return element.source, None, None
+        return element.parent.source or element.source, element.uvs, element.size
+
+    def load_images(self, only_missing=False, reusable_images=None):
+        reusable_images = reusable_images or {}
+        for element, loader, kwargs in self.iter_image_requests(only_missing):
+            image = reusable_images.get(self.get_image_key(element))
+            element.image = loader(**kwargs) if image is None else image
+
+    def load_tile_images(self, tiles):
+        """
+        Set up uvs and images of the given tiles only, e.g. the ones first used by an edit.
+        """
+        for tile in tiles:
+            tileset = tile.parent
+            if not tileset.is_images_collection:
+                uvs = tileset.get_tile_uvs(tile.gid)
+                if uvs is None:
+                    continue
+                tile.set_uvs(uvs)
+            if tile.image is None:
+                tile.image = self.load_image(tileset=tileset)(tile=tile)
+
+    def iter_image_requests(self, only_missing=False):
+        """
+        Yield (element, loader, loader_kwargs) for every tile and image layer that needs an image.
+        """
         tiles = self.tiles
         load_image = self.load_image
         load_unused_tiles = self.load_unused_tiles
@@ -605,7 +1123,8 @@ class TileMap(Element):
             loader = load_image(tileset=tileset)
             if tileset.is_images_collection:
                 for tile in tileset:
-                    tile.image = loader(tile=tile)
+                    if not only_missing or tile.image is None:
+                        yield tile, loader, {'tile': tile}
                 continue
 
             t = tileset
@@ -621,11 +1140,12 @@ class TileMap(Element):
                     tile = tileset.add_tile(None, gid=gid, width=tileset.tilewidth,
                                             height=tileset.tileheight)
                 tile.set_uvs((x, y))
-                tile.image = loader(tile=tile)
+                if not only_missing or tile.image is None:
+                    yield tile, loader, {'tile': tile}
 
         for image_layer in self.image_layers:
-            loader = load_image(image_layer=image_layer)
-            image_layer.image = loader()
+            if not only_missing or image_layer.image is None:
+                yield image_layer, load_image(image_layer=image_layer), {}
 
     def get_tileset_by_gid(self, gid):
         for tileset in reversed(self.tilesets):
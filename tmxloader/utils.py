@@ -1,3 +1,4 @@
+import os
 import struct
 import weakref
 from operator import attrgetter
@@ -8,6 +9,10 @@ FLIPPED_DIAGONALLY_FLAG = 0x20000000
 FLIPPED_HORIZONTALLY_FLAG = 0x80000000
 
 TextureFlags = namedtuple('flags', ('flipped_horizontally', 'flipped_vertically', 'flipped_diagonally'))
+DirtyRegions = namedtuple('DirtyRegions', ('rects', 'chunks'))
+# changed holds (old, new) pairs of elements
+ElementsDiff = namedtuple('ElementsDiff', ('added', 'removed', 'changed', 'unchanged'))
+MapDiff = namedtuple('MapDiff', ('full', 'tilesets', 'layers'))
 
 
 class AnimationFrame(object):
@@ -124,6 +129,22 @@ def to_python(property_name, value):
     return PROPERTIES_TYPES[property_name](value)
 
 
+def get_file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    return stat.st_mtime, stat.st_size
+
+
+def parse_wangid(value):
+    if value.startswith('0x'):
+        # before Tiled 1.5 wang ids were packed into 32 bits, top edge in the lowest nibble
+        number = int(value, 16)
+        return tuple((number >> (4 * i)) & 0xF for i in xrange(8))
+    return tuple(int(v) for v in value.split(','))
+
+
 def unpack_struct(data):
     l = len(data)
     template = '<%dI'
@@ -140,6 +161,18 @@ def decode_gid(gid):
     return gid, flags
 
 
+def encode_gid(gid, flags):
+    # reverse of decode_gid
+    if flags is not None:
+        if flags.flipped_horizontally:
+            gid |= FLIPPED_HORIZONTALLY_FLAG
+        if flags.flipped_vertically:
+            gid |= FLIPPED_VERTICALLY_FLAG
+        if flags.flipped_diagonally:
+            gid |= FLIPPED_DIAGONALLY_FLAG
+    return gid
+
+
 class MultipleElementsException(Exception):
     pass
 
@@ -148,6 +181,24 @@ class ElementNotFound(Exception):
     pass
 
 
+class InvalidLayerData(Exception):
+    pass
+
+
+def run_steps(steps):
+    """
+    Drive a generator which yields None between the steps and callables for the blocking work,
+    each callable is called right away and its result is sent back to the generator.
+    """
+    result = None
+    while True:
+        try:
+            request = steps.send(result)
+        except StopIteration:
+            return
+        result = request() if request is not None else None
+
+
 class FilterIterator(object):
     def __init__(self, iterable):
         self.iterable = iterable
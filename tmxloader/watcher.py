@@ -0,0 +1,41 @@
+import time
+from xml.etree import ElementTree
+
+from utils import InvalidLayerData, get_file_signature
+
+
+class MapWatcher(object):
+    """
+    Polls files the map was built from and reloads it when any of them changes.
+    Call poll() from the game loop, so the map is never modified behind renderer's back.
+    """
+
+    def __init__(self, tile_map, callback=None, interval=1.0):
+        self.tile_map = tile_map
+        self.callback = callback
+        self.interval = interval
+        self.last_poll = None
+
+    def get_changed_files(self):
+        signatures = self.tile_map.file_signatures
+        return [path for path, signature in signatures.iteritems() if get_file_signature(path) != signature]
+
+    def poll(self, force=False):
+        now = time.time()
+        if not force and self.last_poll is not None and now - self.last_poll < self.interval:
+            return
+        self.last_poll = now
+
+        if not self.get_changed_files():
+            return
+
+        try:
+            diff = self.tile_map.reload()
+        except (ElementTree.ParseError, IOError, InvalidLayerData):
+            # the file is most likely still being written, the failed reload left the map
+            # as it was, so try again on the next poll
+            return
+
+        if self.callback is not None:
+            self.callback(diff)
+        return diff
@@ -0,0 +1,358 @@
+"""
+Worlds made of many maps and streaming them around a moving focus point.
+
+World coordinates are pixels with y axis pointing down, like in Tiled's .world files.
+"""
+import os
+import re
+import json
+import math
+import threading
+from Queue import Queue
+from collections import OrderedDict, defaultdict
+from xml.etree import ElementTree
+
+from geometry import get_local_outline, rotate
+from loader import TileMap
+from utils import ObjectType
+
+
+def read_map_size(path):
+    # only the root element is needed, so the rest of the file is never parsed
+    _, node = next(ElementTree.iterparse(path, events=('start', )))
+    return (int(node.get('width')) * int(node.get('tilewidth')),
+            int(node.get('height')) * int(node.get('tileheight')))
+
+
+class WorldMap(object):
+    """
+    Placement of a single map in the world.
+    """
+
+    def __init__(self, source, x, y, width, height):
+        self.source = source
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __unicode__(self):
+        return u'{}@{}'.format(self.__class__.__name__, self.source)
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    @property
+    def rect(self):
+        return self.x, self.y, self.width, self.height
+
+    def contains(self, x, y):
+        return self.x <= x < self.x + self.width and self.y <= y < self.y + self.height
+
+    def intersects(self, x, y, width, height):
+        return (self.x < x + width and x < self.x + self.width and
+                self.y < y + height and y < self.y + self.height)
+
+    def distance(self, x, y):
+        dx = max(self.x - x, 0, x - (self.x + self.width))
+        dy = max(self.y - y, 0, y - (self.y + self.height))
+        return math.hypot(dx, dy)
+
+
+class World(object):
+    def __init__(self, maps):
+        self.maps = list(maps)
+
+        # maps are bucketed by the size of the largest of them
+        self.bucket_size = max([max(m.width, m.height) for m in self.maps] or [1])
+        self.buckets = defaultdict(list)
+        for world_map in self.maps:
+            for bucket in self.get_buckets(*world_map.rect):
+                self.buckets[bucket].append(world_map)
+
+    def __iter__(self):
+        return iter(self.maps)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load Tiled .world file, both explicit maps and file name patterns are supported.
+        """
+        with open(path) as world_file:
+            data = json.load(world_file)
+        base_dir = os.path.dirname(os.path.abspath(path))
+
+        maps = []
+        for entry in data.get('maps', ()):
+            maps.append(WorldMap(
+                os.path.join(base_dir, entry['fileName']),
+                entry['x'], entry['y'], entry['width'], entry['height']
+            ))
+
+        for pattern in data.get('patterns', ()):
+            regexp = re.compile(pattern['regexp'])
+            for file_name in sorted(os.listdir(base_dir)):
+                match = regexp.match(file_name)
+                if match is None:
+                    continue
+                source = os.path.join(base_dir, file_name)
+                width, height = read_map_size(source)
+                x = int(match.group(1)) * pattern.get('multiplierX', 1) + pattern.get('offsetX', 0)
+                y = int(match.group(2)) * pattern.get('multiplierY', 1) + pattern.get('offsetY', 0)
+                maps.append(WorldMap(source, x, y, width, height))
+
+        return cls(maps)
+
+    @classmethod
+    def from_grid(cls, sources, map_width, map_height):
+        """
+        Build world from {(column, row): source} mapping of equally sized maps.
+        """
+        return cls(
+            WorldMap(source, column * map_width, row * map_height, map_width, map_height)
+            for (column, row), source in sorted(sources.iteritems())
+        )
+
+    def get_buckets(self, x, y, width, height):
+        size = self.bucket_size
+        for bx in xrange(int(x // size), int((x + width) // size) + 1):
+            for by in xrange(int(y // size), int((y + height) // size) + 1):
+                yield bx, by
+
+    def get_maps_in_rect(self, x, y, width, height):
+        found = []
+        for bucket in self.get_buckets(x, y, width, height):
+            for world_map in self.buckets.get(bucket, ()):
+                if world_map not in found and world_map.intersects(x, y, width, height):
+                    found.append(world_map)
+        return found
+
+    def get_map_at(self, x, y):
+        size = self.bucket_size
+        for world_map in self.buckets.get((int(x // size), int(y // size)), ()):
+            if world_map.contains(x, y):
+                return world_map
+
+
+def estimate_map_size(tile_map):
+    """
+    Rough cost of keeping the map in memory: number of cells and objects.
+    """
+    cells = sum(layer.width * layer.height for layer in tile_map.tile_layers)
+    return cells + sum(1 for _ in tile_map.objects)
+
+
+def get_object_rect(obj, map_height):
+    """
+    Bounding rect of the object relative to the map's top-left corner.
+    """
+    y = map_height - obj.y if obj.root.invert_y else obj.y
+    outline = get_local_outline(obj)
+    if obj.type == ObjectType.Ellipse:
+        rx, ry = obj.width / 2.0, obj.height / 2.0
+        (cx, cy), (ux, uy), (vx, vy) = rotate([(rx, ry), (rx, 0), (0, ry)], obj.rotation)
+        half_width, half_height = math.hypot(ux, vx), math.hypot(uy, vy)
+        outline = [(cx - half_width, cy - half_height), (cx + half_width, cy + half_height)]
+
+    xs = [obj.x + x for x, _ in outline]
+    ys = [y + oy for _, oy in outline]
+    return min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)
+
+
+class WorldStreamer(object):
+    """
+    Keeps maps around the focus point loaded.
+
+    Maps are loaded by background threads using map_loader (TileMap by default,
+    so the image loader has to be safe to call from other threads) and become
+    available on the next update() call. Maps that are no longer needed are kept
+    until memory_budget (in units of estimate_size) or max_maps is exceeded,
+    then the least recently used ones are evicted.
+    Maps that failed to load end up in `errors` and aren't requested again
+    until their entry is removed.
+    """
+
+    def __init__(self, world, map_loader=TileMap, load_distance=512, lookahead=1.0,
+                 memory_budget=None, max_maps=None, estimate_size=estimate_map_size,
+                 workers=1, on_load=None, on_evict=None):
+        self.world = world
+        self.map_loader = map_loader
+        self.load_distance = load_distance
+        self.lookahead = lookahead
+        self.memory_budget = memory_budget
+        self.max_maps = max_maps
+        self.estimate_size = estimate_size
+        self.on_load = on_load
+        self.on_evict = on_evict
+
+        # least recently used maps first
+        self.loaded = OrderedDict()
+        self.sizes = {}
+        self.pending = set()
+        self.errors = {}
+        self.wanted = frozenset()
+
+        self.requests = Queue()
+        self.results = Queue()
+        self.threads = []
+        for _ in xrange(workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    @property
+    def used_memory(self):
+        return sum(self.sizes.itervalues())
+
+    def work(self):
+        while True:
+            world_map = self.requests.get()
+            if world_map is None:
+                return
+            if world_map not in self.wanted:
+                # focus moved away before the map was picked up
+                self.results.put((world_map, None, None))
+                continue
+            try:
+                tile_map = self.map_loader(world_map.source)
+            except Exception as error:
+                self.results.put((world_map, None, error))
+            else:
+                self.results.put((world_map, tile_map, None))
+
+    def close(self):
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def update(self, focus, velocity=(0, 0)):
+        """
+        Request maps near the focus point and along the way to the point it will reach
+        in `lookahead` seconds, collect loaded maps and evict unused ones.
+        """
+        self.collect_results()
+
+        x, y = focus
+        dx = velocity[0] * self.lookahead
+        dy = velocity[1] * self.lookahead
+        distance = self.load_distance
+        # sample the path densely enough for the boxes around the samples to overlap
+        steps = max(int(math.ceil(math.hypot(dx, dy) / distance)), 1)
+        wanted = set()
+        for step in xrange(steps + 1):
+            t = float(step) / steps
+            px, py = x + dx * t, y + dy * t
+            wanted.update(self.world.get_maps_in_rect(px - distance, py - distance, 2 * distance, 2 * distance))
+        self.wanted = frozenset(wanted)
+
+        for world_map in sorted(wanted, key=lambda m: m.distance(x, y)):
+            if world_map in self.loaded:
+                self.touch(world_map)
+            elif world_map not in self.pending and world_map not in self.errors:
+                self.pending.add(world_map)
+                self.requests.put(world_map)
+
+        self.evict()
+
+    def collect_results(self):
+        while not self.results.empty():
+            self.handle_result(*self.results.get())
+
+    def handle_result(self, world_map, tile_map, error):
+        self.pending.discard(world_map)
+        if error is not None:
+            self.errors[world_map] = error
+        elif tile_map is not None and world_map not in self.loaded:
+            self.add(world_map, tile_map)
+
+    def wait_for(self, world_map):
+        while world_map in self.pending:
+            self.handle_result(*self.results.get())
+
+    def add(self, world_map, tile_map):
+        self.loaded[world_map] = tile_map
+        self.sizes[world_map] = self.estimate_size(tile_map)
+        if self.on_load is not None:
+            self.on_load(world_map, tile_map)
+
+    def touch(self, world_map):
+        self.loaded[world_map] = self.loaded.pop(world_map)
+
+    def is_over_budget(self):
+        if self.max_maps is not None and len(self.loaded) > self.max_maps:
+            return True
+        return self.memory_budget is not None and self.used_memory > self.memory_budget
+
+    def evict(self):
+        candidates = [m for m in self.loaded if m not in self.wanted]
+        while candidates and self.is_over_budget():
+            world_map = candidates.pop(0)
+            tile_map = self.loaded.pop(world_map)
+            del self.sizes[world_map]
+            if self.on_evict is not None:
+                self.on_evict(world_map, tile_map)
+
+    def get_map(self, world_map, block=False):
+        """
+        Return loaded TileMap, with block=True maps that are being loaded are waited for
+        and the ones that aren't loaded at all are loaded right away.
+        """
+        if block:
+            self.wait_for(world_map)
+
+        tile_map = self.loaded.get(world_map)
+        if tile_map is not None:
+            self.touch(world_map)
+        elif block:
+            tile_map = self.map_loader(world_map.source)
+            self.errors.pop(world_map, None)
+            self.add(world_map, tile_map)
+        return tile_map
+
+    def get_map_at(self, x, y, block=False):
+        world_map = self.world.get_map_at(x, y)
+        if world_map is None:
+            return None, None
+        return world_map, self.get_map(world_map, block)
+
+    def get_cells(self, x, y, block=False):
+        """
+        Cells of all tile layers at the given world position, bottom layer first.
+        """
+        world_map, tile_map = self.get_map_at(x, y, block)
+        if tile_map is None:
+            return []
+        column = int((x - world_map.x) // tile_map.tilewidth)
+        row = int((y - world_map.y) // tile_map.tileheight)
+        cells = []
+        for layer in tile_map.tile_layers:
+            if column < layer.width and row < layer.height:
+                cell = layer.get_cell(column, row)
+                if cell is not None:
+                    cells.append(cell)
+        return cells
+
+    def get_cell(self, x, y, layer_name, block=False):
+        for cell in self.get_cells(x, y, block):
+            if cell.parent.name == layer_name:
+                return cell
+
+    def get_objects_in_rect(self, x, y, width, height):
+        """
+        (world_map, object) pairs of the loaded maps, whose bounding rect intersects the given one.
+        """
+        found = []
+        for world_map in self.world.get_maps_in_rect(x, y, width, height):
+            tile_map = self.loaded.get(world_map)
+            if tile_map is None:
+                continue
+            map_height = tile_map.size[1]
+            local_x, local_y = x - world_map.x, y - world_map.y
+            for obj in tile_map.objects:
+                ox, oy, ow, oh = get_object_rect(obj, map_height)
+                if ox <= local_x + width and local_x <= ox + ow and oy <= local_y + height and local_y <= oy + oh:
+                    found.append((world_map, obj))
+        return found